@@ -5,10 +5,9 @@ Streamlit frontend for the Finance RAG Q&A System.
 Run with: streamlit run app.py
 """
 
+import hashlib
 import os
-import tempfile
 import streamlit as st
-from pathlib import Path
 from rag_pipeline import FinanceRAGPipeline
 
 # ──────────────────────────────────────────────
@@ -74,14 +73,68 @@ st.markdown("""
 # ──────────────────────────────────────────────
 # SESSION STATE
 # ──────────────────────────────────────────────
+MAX_HISTORY = 20  # bound per-session memory; older Q&A entries are dropped
+
 if "pipeline" not in st.session_state:
     st.session_state.pipeline = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 if "docs_loaded" not in st.session_state:
     st.session_state.docs_loaded = []
-if "total_chunks" not in st.session_state:
-    st.session_state.total_chunks = 0
+if "index_dir" not in st.session_state:
+    st.session_state.index_dir = None
+if "reset_count" not in st.session_state:
+    st.session_state.reset_count = 0
+
+# The pipeline is shared across sessions; if another session reset it, forget
+# the uploads this one remembers so they can be ingested again
+if st.session_state.pipeline and st.session_state.pipeline.reset_count != st.session_state.reset_count:
+    st.session_state.docs_loaded = []
+    st.session_state.reset_count = st.session_state.pipeline.reset_count
+
+
+# ──────────────────────────────────────────────
+# SHARED PIPELINE
+# ──────────────────────────────────────────────
+INDEX_DIR = "faiss_index"
+
+
+def index_path(api_key_hash: str, model: str, embedding_backend: str, compact: bool, rerank: bool) -> str:
+    """
+    One directory per get_pipeline cache entry, so documents never leak
+    across API keys and no two cached pipelines rewrite the same shards.
+    """
+    variant = "-".join(
+        [embedding_backend, model] + ["compact"] * compact + ["rerank"] * rerank
+    )
+    return os.path.join(INDEX_DIR, api_key_hash[:16], variant)
+
+
+@st.cache_resource(show_spinner=False)
+def get_pipeline(
+    api_key_hash: str,
+    _api_key: str,
+    model: str,
+    embedding_backend: str,
+    compact: bool,
+    rerank: bool,
+) -> FinanceRAGPipeline:
+    """
+    One pipeline per (key, model, embeddings) shared across sessions and reruns.
+    The raw key is underscore-prefixed so Streamlit keys the cache on its hash.
+    """
+    pipeline = FinanceRAGPipeline(
+        api_key=_api_key,
+        model=model,
+        temperature=0.0,
+        embedding_backend=embedding_backend,
+        compact=compact,
+        rerank=rerank,
+    )
+    path = index_path(api_key_hash, model, embedding_backend, compact, rerank)
+    if os.path.isdir(path):
+        pipeline.load_index(path)
+    return pipeline
 
 
 # ──────────────────────────────────────────────
@@ -108,16 +161,43 @@ with st.sidebar:
         help="GPT-4 gives better analysis but costs more.",
     )
 
+    embedding_labels = {
+        "openai-3-small": "OpenAI 3-small, 512-d (cloud)",
+        "openai": "OpenAI ada-002 (cloud)",
+        "hf": "bge-small (local, GPU if available)",
+        "hf-gpu": "bge-small (local, GPU)",
+    }
+    embedding_choice = st.selectbox(
+        "🧬 Embeddings",
+        list(embedding_labels),
+        index=0,
+        format_func=embedding_labels.get,
+        help="Local embeddings skip the OpenAI round-trip and need sentence-transformers installed.",
+    )
+
+    compact_index = st.checkbox(
+        "🗜️ Compact index (IVF-PQ)",
+        value=False,
+        help="Compresses vectors ~32x for large corpora, at a small recall cost.",
+    )
+
+    rerank = st.checkbox(
+        "🎯 Rerank results (cross-encoder)",
+        value=False,
+        help="Retrieves 25 candidates and keeps the best 5 with bge-reranker-base. Needs sentence-transformers.",
+    )
+
     st.divider()
 
     # Initialize pipeline
     if api_key and st.button("✅ Initialize Pipeline", use_container_width=True):
         with st.spinner("Setting up RAG pipeline..."):
-            st.session_state.pipeline = FinanceRAGPipeline(
-                api_key=api_key,
-                model=model_choice,
-                temperature=0.0,
-            )
+            key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+            options = (model_choice, embedding_choice, compact_index, rerank)
+            st.session_state.pipeline = get_pipeline(key_hash, api_key, *options)
+            # Saves and resets go to the initialized pipeline's own directory
+            st.session_state.index_dir = index_path(key_hash, *options)
+            st.session_state.reset_count = st.session_state.pipeline.reset_count
         st.success("Pipeline ready!")
 
     st.divider()
@@ -131,20 +211,20 @@ with st.sidebar:
     )
 
     if uploaded_files and st.session_state.pipeline:
-        for uploaded_file in uploaded_files:
-            if uploaded_file.name not in st.session_state.docs_loaded:
-                with st.spinner(f"Processing {uploaded_file.name}..."):
-                    with tempfile.NamedTemporaryFile(
-                        delete=False,
-                        suffix=Path(uploaded_file.name).suffix
-                    ) as tmp:
-                        tmp.write(uploaded_file.read())
-                        tmp_path = tmp.name
-                    chunks = st.session_state.pipeline.ingest_file(tmp_path)
-                    st.session_state.docs_loaded.append(uploaded_file.name)
-                    st.session_state.total_chunks += chunks
-                    os.unlink(tmp_path)
-                st.success(f"✓ {uploaded_file.name} — {chunks} chunks")
+        new_files = [
+            f for f in uploaded_files
+            if f.name not in st.session_state.docs_loaded
+        ]
+        if new_files:
+            with st.spinner(f"Processing {len(new_files)} file(s)..."):
+                chunks = st.session_state.pipeline.ingest_bytes(
+                    [(f.name, f.getvalue()) for f in new_files]
+                )
+                st.session_state.pipeline.save_index(st.session_state.index_dir)
+                st.session_state.docs_loaded.extend(f.name for f in new_files)
+            st.success(
+                f"✓ {', '.join(f.name for f in new_files)} — {chunks} chunks"
+            )
 
     # Paste Text Option
     st.divider()
@@ -159,7 +239,7 @@ with st.sidebar:
     if pasted_text and st.button("📥 Load Text", use_container_width=True):
         if st.session_state.pipeline:
             chunks = st.session_state.pipeline.ingest_text(pasted_text, paste_source)
-            st.session_state.total_chunks += chunks
+            st.session_state.pipeline.save_index(st.session_state.index_dir)
             st.success(f"Loaded {chunks} chunks from pasted text.")
         else:
             st.warning("Initialize the pipeline first.")
@@ -170,16 +250,19 @@ with st.sidebar:
         st.markdown("### 📊 Index Stats")
         col1, col2 = st.columns(2)
         col1.metric("Documents", len(st.session_state.docs_loaded))
-        col2.metric("Chunks", st.session_state.total_chunks)
+        col2.metric("Chunks", st.session_state.pipeline.document_count)
 
     # Reset
     st.divider()
     if st.button("🗑️ Reset Everything", use_container_width=True):
         if st.session_state.pipeline:
-            st.session_state.pipeline.reset()
+            # Empties the cached pipeline in place for every session sharing
+            # this key and settings, and deletes its saved index
+            st.session_state.pipeline.reset(st.session_state.index_dir)
+        st.session_state.pipeline = None
+        st.session_state.index_dir = None
         st.session_state.chat_history = []
         st.session_state.docs_loaded = []
-        st.session_state.total_chunks = 0
         st.rerun()
 
 
@@ -203,6 +286,26 @@ for i, suggestion in enumerate(suggestions):
     if cols[i].button(suggestion, key=f"sug_{i}", use_container_width=True):
         st.session_state["prefilled_query"] = suggestion
 
+if st.button("⚡ Run all suggestions"):
+    if not st.session_state.pipeline:
+        st.error("⚠️ Please enter your API key and initialize the pipeline in the sidebar.")
+    elif st.session_state.pipeline.document_count == 0:
+        st.warning("📂 Please upload at least one financial document first.")
+    else:
+        with st.spinner(f"🔍 Answering {len(suggestions)} questions in parallel..."):
+            try:
+                results = st.session_state.pipeline.query_many(suggestions)
+                for suggestion, result in zip(suggestions, results):
+                    st.session_state.chat_history.append({
+                        "question": suggestion,
+                        "answer": result["answer"],
+                        "sources": result["sources"],
+                        "chunks": result["chunks"],
+                    })
+                st.session_state.chat_history = st.session_state.chat_history[-MAX_HISTORY:]
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+
 st.divider()
 
 # Query Input
@@ -223,20 +326,25 @@ if col_clear.button("Clear History", use_container_width=False):
 if ask_btn and question:
     if not st.session_state.pipeline:
         st.error("⚠️ Please enter your API key and initialize the pipeline in the sidebar.")
-    elif st.session_state.total_chunks == 0:
+    elif st.session_state.pipeline.document_count == 0:
         st.warning("📂 Please upload at least one financial document first.")
     else:
-        with st.spinner("🔍 Searching documents and generating answer..."):
-            try:
-                result = st.session_state.pipeline.query(question)
-                st.session_state.chat_history.append({
-                    "question": question,
-                    "answer": result["answer"],
-                    "sources": result["sources"],
-                    "chunks": result["chunks"],
-                })
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+        try:
+            with st.spinner("🔍 Searching documents..."):
+                result, tokens = st.session_state.pipeline.stream_query(question)
+            st.markdown(f"**Q: {question}**")
+            # Render tokens as they arrive; the full answer moves into history below
+            answer = st.write_stream(tokens)
+            st.session_state.chat_history.append({
+                "question": question,
+                "answer": answer,
+                "sources": result["sources"],
+                "chunks": result["chunks"],
+            })
+            st.session_state.chat_history = st.session_state.chat_history[-MAX_HISTORY:]
+            st.rerun()
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
 
 # Display Chat History
 if st.session_state.chat_history:
@@ -263,7 +371,7 @@ if st.session_state.chat_history:
             for j, chunk in enumerate(entry["chunks"]):
                 st.markdown(f"""
                 <div class="chunk-box">
-                    <strong>Chunk {j+1}:</strong><br>{chunk}...
+                    <strong>Chunk {j+1}:</strong><br>{chunk.page_content[:300]}...
                 </div>
                 """, unsafe_allow_html=True)
 
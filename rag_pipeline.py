@@ -5,16 +5,43 @@ Core RAG (Retrieval-Augmented Generation) pipeline for Finance Q&A.
 Handles document ingestion, embedding, vector storage, and LLM querying.
 """
 
+import asyncio
+import gc
+import hashlib
+import io
+import json
 import os
+import pickle
 import re
-from typing import List, Tuple
+import shutil
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Tuple
 from pathlib import Path
 
+import faiss
+import numpy as np
+import tiktoken
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from pypdf import PdfReader
+
+try:
+    import pdfplumber
+except ImportError:  # optional — enables table detection in PDFs
+    pdfplumber = None
 from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.chains import RetrievalQA
+from openai import AsyncOpenAI, OpenAI
+from langchain.chains.question_answering import load_qa_chain
+from langchain.retrievers.document_compressors import CrossEncoderReranker
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
 
@@ -45,29 +72,423 @@ Answer (be precise and cite data where possible):
 # ──────────────────────────────────────────────
 # DOCUMENT PROCESSOR
 # ──────────────────────────────────────────────
+class CompiledSeparatorSplitter(RecursiveCharacterTextSplitter):
+    """
+    RecursiveCharacterTextSplitter that compiles its separator patterns once
+    in __init__ instead of escaping and looking them up on every recursive call.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._patterns = {
+            sep: re.compile(sep if self._is_separator_regex else re.escape(sep))
+            for sep in self._separators
+            if sep
+        }
+        self._split_patterns = {
+            sep: re.compile(f"({pattern.pattern})") if self._keep_separator else pattern
+            for sep, pattern in self._patterns.items()
+        }
+
+    def _split_with_separator(self, text: str, separator: str) -> List[str]:
+        if not separator:
+            return list(text)
+        _splits = self._split_patterns[separator].split(text)
+        if not self._keep_separator:
+            return [s for s in _splits if s != ""]
+        # Re-attach the captured separators, mirroring LangChain's behaviour
+        if self._keep_separator == "end":
+            splits = [_splits[i] + _splits[i + 1] for i in range(0, len(_splits) - 1, 2)]
+            if len(_splits) % 2 == 0:
+                splits += _splits[-1:]
+            splits = splits + [_splits[-1]]
+        else:
+            splits = [_splits[i] + _splits[i + 1] for i in range(1, len(_splits), 2)]
+            if len(_splits) % 2 == 0:
+                splits += _splits[-1:]
+            splits = [_splits[0]] + splits
+        return [s for s in splits if s != ""]
+
+    def _split_text(self, text: str, separators: List[str]) -> List[str]:
+        final_chunks = []
+        separator = separators[-1]
+        new_separators = []
+        for i, _s in enumerate(separators):
+            if _s == "":
+                separator = _s
+                break
+            if self._patterns[_s].search(text):
+                separator = _s
+                new_separators = separators[i + 1:]
+                break
+
+        splits = self._split_with_separator(text, separator)
+
+        # Merge small splits, recursing into ones that are still too long
+        _good_splits = []
+        _separator = "" if self._keep_separator else separator
+        for s in splits:
+            if self._length_function(s) < self._chunk_size:
+                _good_splits.append(s)
+            else:
+                if _good_splits:
+                    final_chunks.extend(self._merge_splits(_good_splits, _separator))
+                    _good_splits = []
+                if not new_separators:
+                    final_chunks.append(s)
+                else:
+                    final_chunks.extend(self._split_text(s, new_separators))
+        if _good_splits:
+            final_chunks.extend(self._merge_splits(_good_splits, _separator))
+        return final_chunks
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def tiktoken_len(text: str) -> int:
+    return len(_get_encoding().encode(text))
+
+
+MIN_CHUNK_TOKENS = 80
+
+
+def _join_chunks(prev: str, nxt: str, overlap: int = 0) -> str:
+    """Concatenate neighbouring chunks; the first `overlap` chars of nxt repeat prev's end."""
+    if overlap and prev.endswith(nxt[:overlap]):
+        return prev + nxt[overlap:]
+    return prev + "\n" + nxt
+
+
+def _same_text(a: Document, b: Document) -> bool:
+    """Whether both chunks carry splitter start_index offsets into the same page."""
+    return (
+        "start_index" in a.metadata
+        and "start_index" in b.metadata
+        and all(a.metadata.get(key) == b.metadata.get(key) for key in ("source", "page"))
+    )
+
+
+def _merge_pair(a: Document, b: Document) -> Document:
+    # Keep the metadata (page, section) of the larger neighbour
+    larger = a if len(a.page_content) >= len(b.page_content) else b
+    metadata = dict(larger.metadata)
+    overlap = 0
+    if _same_text(a, b):
+        # The splitter's start_index offsets give the real chunk_overlap
+        start_a, start_b = a.metadata["start_index"], b.metadata["start_index"]
+        if start_b > start_a:
+            overlap = min(max(0, start_a + len(a.page_content) - start_b), len(b.page_content))
+        metadata["start_index"] = start_a
+    else:
+        metadata.pop("start_index", None)
+    return Document(page_content=_join_chunks(a.page_content, b.page_content, overlap), metadata=metadata)
+
+
+def merge_small_chunks(
+    docs: List[Document],
+    min_tokens: int,
+    length_function: Callable[[str], int],
+    max_chars: Optional[int] = None,
+) -> List[Document]:
+    """
+    Fold chunks under min_tokens into the previous chunk, or into the next one
+    when nothing precedes them. Tables are never merged. With max_chars, a
+    merge that would grow a chunk past it is skipped.
+    """
+    merged: List[Document] = []
+    pending = None  # small chunk waiting for a following neighbour
+    for doc in docs:
+        if doc.metadata.get("is_table"):
+            merged.append(doc)
+            continue
+        if pending is not None:
+            candidate = _merge_pair(pending, doc)
+            if max_chars is None or len(candidate.page_content) <= max_chars:
+                doc = candidate
+            else:
+                merged.append(pending)
+            pending = None
+        if length_function(doc.page_content) >= min_tokens:
+            merged.append(doc)
+        elif merged and not merged[-1].metadata.get("is_table"):
+            candidate = _merge_pair(merged[-1], doc)
+            if max_chars is None or len(candidate.page_content) <= max_chars:
+                merged[-1] = candidate
+            else:
+                merged.append(doc)
+        else:
+            pending = doc
+    if pending is not None:
+        merged.append(pending)
+    return merged
+
+
+# A PDF as a stream of (text, metadata, is_table) blocks, one page at a time
+Block = Tuple[str, dict, bool]
+
+
+def _page_blocks(pages: Iterable[Document]) -> Iterator[Block]:
+    for page in pages:
+        yield page.page_content, page.metadata, False
+
+
+def _table_to_text(rows: List[List[Optional[str]]]) -> str:
+    return "\n".join(" | ".join((cell or "").strip() for cell in row) for row in rows)
+
+
+def _pdfplumber_blocks(pdf_file, source: str) -> Iterator[Block]:
+    """Page text with tables cut out, followed by each table as its own block."""
+    with pdfplumber.open(pdf_file) as pdf:
+        for i, page in enumerate(pdf.pages):
+            metadata = {"source": source, "page": i}
+            tables = page.find_tables()
+            text_page = page
+            for table in tables:
+                text_page = text_page.outside_bbox(table.bbox, strict=False)
+            yield text_page.extract_text() or "", metadata, False
+            for table in tables:
+                yield _table_to_text(table.extract()), metadata, True
+            page.close()
+
+
+@lru_cache(maxsize=8)
+def _get_line_splitter(chunk_size: int, length_function: Callable[[str], int]) -> CompiledSeparatorSplitter:
+    """Sentence-level splitter for oversized lines, shared by chunkers with the same settings."""
+    return CompiledSeparatorSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=0,
+        length_function=length_function,
+        separators=[". ", "; ", " "],
+    )
+
+
+class FinanceSectionChunker:
+    """
+    Section-aware chunker for 10-K style filings.
+
+    Starts a new chunk at every Item / PART heading (and at summary-style
+    headings), packs section text up to target_tokens with a small overlap,
+    keeps each table as a single chunk (split by rows only above
+    table_max_tokens), and merges chunks under min_tokens into a neighbour.
+    """
+
+    SECTION_RE = re.compile(r"^\s*(Item\s+\d+[A-Z]?\.|PART\s+[IVX]+\b)", re.IGNORECASE)
+    HEADING_RE = re.compile(
+        r"^\s*(Risk Factors|Management['’]s Discussion and Analysis\b.*|MD&A|"
+        r"Financial Statements\b.*|Executive Summary|Summary|Overview|Abstract)\s*$",
+        re.IGNORECASE,
+    )
+
+    def __init__(
+        self,
+        target_tokens: int = 1000,
+        table_max_tokens: int = 1200,
+        min_tokens: int = MIN_CHUNK_TOKENS,
+        overlap_ratio: float = 0.05,
+        length_function: Optional[Callable[[str], int]] = None,
+    ):
+        self.target_tokens = target_tokens
+        self.table_max_tokens = table_max_tokens
+        self.min_tokens = min_tokens
+        self.overlap_tokens = int(target_tokens * overlap_ratio)
+        self.length_function = length_function or tiktoken_len
+        # Fallback for single lines over target_tokens; leaves room for the overlap tail
+        self.line_splitter = _get_line_splitter(target_tokens - self.overlap_tokens, self.length_function)
+
+    def is_heading(self, line: str) -> bool:
+        line = line.strip()
+        if not line or len(line) > 100:
+            return False
+        if self.SECTION_RE.match(line):
+            return True
+        return bool(self.HEADING_RE.match(line)) and not line.endswith(".")
+
+    def _overlap_tail(self, lines: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        tail, total = [], 0
+        for line, tokens in reversed(lines):
+            if total + tokens > self.overlap_tokens:
+                break
+            tail.insert(0, (line, tokens))
+            total += tokens
+        return tail
+
+    def _split_table(self, text: str) -> List[str]:
+        if self.length_function(text) <= self.table_max_tokens:
+            return [text]
+        # Oversized table: split by rows, repeating the header row in each part
+        header, *rows = text.split("\n")
+        parts, current = [], [header]
+        for row in rows:
+            if len(current) > 1 and self.length_function("\n".join(current + [row])) > self.table_max_tokens:
+                parts.append("\n".join(current))
+                current = [header]
+            current.append(row)
+        parts.append("\n".join(current))
+        return parts
+
+    def _merge_small(self, chunks: List[Document]) -> List[Document]:
+        return merge_small_chunks(chunks, self.min_tokens, self.length_function)
+
+    def _lines(self, text: str) -> Iterator[Tuple[str, int]]:
+        """
+        Non-blank lines with their token counts. PDFs often extract a whole
+        paragraph or page as one line; those are split recursively.
+        """
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            tokens = self.length_function(line)
+            if tokens <= self.target_tokens:
+                yield line, tokens
+                continue
+            for piece in self.line_splitter.split_text(line):
+                yield piece, self.length_function(piece)
+
+    def split(self, blocks: Iterable[Block]) -> List[Document]:
+        chunks: List[Document] = []
+        section = None
+        lines: List[Tuple[str, int]] = []  # (line, tokens) for the chunk being built
+        total = 0
+        carried = 0  # leading lines of `lines` that overlap the previous chunk
+        metadata: dict = {}
+        fresh = True  # next line starts a new chunk and sets its page metadata
+
+        def emit() -> None:
+            text = "\n".join(line for line, _ in lines).strip()
+            if not text:
+                return
+            if carried and total < self.min_tokens:
+                # A short remainder after a target split: append only its new
+                # lines to the previous text chunk rather than repeating the overlap
+                rest = "\n".join(line for line, _ in lines[carried:]).strip()
+                if not rest:
+                    return  # nothing but the overlap, which that chunk already ends with
+                i = next(i for i in reversed(range(len(chunks))) if not chunks[i].metadata["is_table"])
+                chunks[i] = Document(
+                    page_content=chunks[i].page_content + "\n" + rest,
+                    metadata=chunks[i].metadata,
+                )
+                return
+            chunks.append(Document(
+                page_content=text,
+                metadata={**metadata, "section": section, "is_table": False},
+            ))
+
+        for text, block_metadata, is_table in blocks:
+            if is_table:
+                for part in self._split_table(text):
+                    chunks.append(Document(
+                        page_content=part,
+                        metadata={**block_metadata, "section": section, "is_table": True},
+                    ))
+                continue
+
+            for line, tokens in self._lines(text):
+                if self.is_heading(line):
+                    emit()
+                    lines, total, carried, fresh = [], 0, 0, True
+                    section = line.strip()
+                elif lines and total + tokens > self.target_tokens:
+                    emit()
+                    lines = self._overlap_tail(lines)
+                    total, carried, fresh = sum(t for _, t in lines), len(lines), True
+                if fresh:
+                    metadata, fresh = block_metadata, False
+                lines.append((line, tokens))
+                total += tokens
+
+        emit()
+        return self._merge_small(chunks)
+
+
+@lru_cache(maxsize=8)
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> CompiledSeparatorSplitter:
+    """Splitters are stateless, so one per (size, overlap) is shared process-wide."""
+    return CompiledSeparatorSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", ".", " "],
+        # Offsets let merge_small_chunks trim the exact overlap between neighbours
+        add_start_index=True,
+    )
+
+
 class DocumentProcessor:
     """Loads and chunks financial documents for embedding."""
 
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 150):
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", ".", " "],
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 150, section_aware: bool = True):
+        self.splitter = _get_splitter(chunk_size, chunk_overlap)
+        # PDFs (10-Ks, earnings reports) go through the section-aware chunker
+        self.section_aware = section_aware
+        self.chunker = FinanceSectionChunker()
+
+    def _merge_small(self, docs: List[Document]) -> List[Document]:
+        """
+        Merge chunks under MIN_CHUNK_TOKENS into a neighbour — tiny chunks cost
+        a full embedding each and crowd out useful hits. A merged chunk may
+        grow by at most chunk_overlap past chunk_size.
+        """
+        return merge_small_chunks(
+            docs,
+            MIN_CHUNK_TOKENS,
+            self.chunker.length_function,
+            max_chars=self.splitter._chunk_size + self.splitter._chunk_overlap,
         )
 
     def load_pdf(self, file_path: str) -> List[Document]:
+        # The section-aware chunker merges small chunks itself
+        if self.section_aware:
+            if pdfplumber is not None:
+                return self.chunker.split(_pdfplumber_blocks(file_path, file_path))
+            return self.chunker.split(_page_blocks(PyPDFLoader(file_path).lazy_load()))
+
         loader = PyPDFLoader(file_path)
-        pages = loader.load()
-        return self.splitter.split_documents(pages)
+        # Split page by page so only one unsplit page is held in memory at a time
+        return self._merge_small([
+            chunk
+            for page in loader.lazy_load()
+            for chunk in self.splitter.split_documents([page])
+        ])
+
+    @staticmethod
+    def _pdf_bytes_pages(data: bytes, source: str) -> Iterator[Document]:
+        reader = PdfReader(io.BytesIO(data))
+        for i, page in enumerate(reader.pages):
+            yield Document(page_content=page.extract_text() or "", metadata={"source": source, "page": i})
+
+    def load_pdf_bytes(self, data: bytes, source: str) -> List[Document]:
+        """Parse an in-memory PDF (e.g. a Streamlit upload) without a temp file."""
+        if self.section_aware:
+            if pdfplumber is not None:
+                return self.chunker.split(_pdfplumber_blocks(io.BytesIO(data), source))
+            return self.chunker.split(_page_blocks(self._pdf_bytes_pages(data, source)))
+
+        return self._merge_small([
+            chunk
+            for page in self._pdf_bytes_pages(data, source)
+            for chunk in self.splitter.split_documents([page])
+        ])
+
+    def load_bytes(self, data: bytes, source: str) -> List[Document]:
+        ext = Path(source).suffix.lower()
+        if ext == ".pdf":
+            return self.load_pdf_bytes(data, source)
+        elif ext in [".txt", ".md"]:
+            return self.load_raw_text(data.decode("utf-8"), source)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}. Use PDF or TXT.")
 
     def load_text(self, file_path: str) -> List[Document]:
         loader = TextLoader(file_path, encoding="utf-8")
         docs = loader.load()
-        return self.splitter.split_documents(docs)
+        return self._merge_small(self.splitter.split_documents(docs))
 
     def load_raw_text(self, text: str, source_name: str = "uploaded_text") -> List[Document]:
         doc = Document(page_content=text, metadata={"source": source_name})
-        return self.splitter.split_documents([doc])
+        return self._merge_small(self.splitter.split_documents([doc]))
 
     def load_file(self, file_path: str) -> List[Document]:
         ext = Path(file_path).suffix.lower()
@@ -79,47 +500,506 @@ class DocumentProcessor:
             raise ValueError(f"Unsupported file type: {ext}. Use PDF or TXT.")
 
 
+# Pool workers — kept at module level so they can be pickled
+def _parse_pdf_worker(path: str, processor: DocumentProcessor) -> List[Document]:
+    return processor.load_pdf(path)
+
+
+def _parse_pdf_bytes_worker(data: bytes, source: str, processor: DocumentProcessor) -> List[Document]:
+    return processor.load_pdf_bytes(data, source)
+
+
 # ──────────────────────────────────────────────
 # VECTOR STORE MANAGER
 # ──────────────────────────────────────────────
+EmbeddingBackend = Literal["openai", "openai-3-small", "hf", "hf-gpu"]
+HF_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+
+
+class OpenAIBatchEmbeddings(Embeddings):
+    """
+    Embeddings from the openai client directly, skipping LangChain's
+    OpenAIEmbeddings wrapper. Sends up to batch_size inputs per request and
+    asks text-embedding-3-small for reduced-dimension vectors (512 by default),
+    a third of the index size of ada-002.
+    """
+
+    # Rough per-request token budget (the API rejects oversized batches);
+    # estimated at ~4 characters per token
+    MAX_BATCH_CHARS = 4 * 250_000
+
+    def __init__(self, model: str = "text-embedding-3-small", dimensions: int = 512, batch_size: int = 1024):
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.client = OpenAI()
+        self.async_client = AsyncOpenAI()
+
+    def _batches(self, texts: List[str]) -> Iterator[List[str]]:
+        batch, chars = [], 0
+        for text in texts:
+            if batch and (len(batch) == self.batch_size or chars + len(text) > self.MAX_BATCH_CHARS):
+                yield batch
+                batch, chars = [], 0
+            batch.append(text)
+            chars += len(text)
+        if batch:
+            yield batch
+
+    def _request(self, batch: List[str]) -> dict:
+        return {"input": batch, "model": self.model, "dimensions": self.dimensions}
+
+    @staticmethod
+    def _vectors(response) -> List[List[float]]:
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for batch in self._batches(texts):
+            vectors.extend(self._vectors(self.client.embeddings.create(**self._request(batch))))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        response = await self.async_client.embeddings.create(**self._request([text]))
+        return self._vectors(response)[0]
+
+
+# HNSW graph parameters — sub-linear search instead of an exhaustive flat scan
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# IVF-PQ parameters for compact indexes — 1536 floats compress to 48 bytes
+IVF_NLIST = 256
+IVF_NPROBE = 16
+PQ_M = 48
+PQ_NBITS = 8
+PQ_MIN_TRAIN = 2 ** PQ_NBITS  # PQ codebooks need at least one point per centroid
+IVF_POINTS_PER_LIST = 39  # FAISS wants ~39 training points per IVF centroid
+# A codebook trained on a small corpus is retrained each time the corpus grows
+# this many times over, until there is enough data for the full IVF_NLIST
+PQ_RETRAIN_GROWTH = 4
+PQ_FULL_TRAIN = IVF_POINTS_PER_LIST * IVF_NLIST
+
+SHARD_MANIFEST = "shards.json"
+# Trained, empty IVF-PQ index that every compact shard is cloned from
+PQ_TEMPLATE = "pq_template.faiss"
+# Saved indexes are memory-mapped on load so the OS pages them in on demand.
+# FAISS only maps IVF inverted lists; HNSW shards are still read into RAM.
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+# Cosine similarity above which a previous answer is reused for a new question
+QCACHE_THRESHOLD = 0.97
+
+
+def _make_embeddings(backend: EmbeddingBackend):
+    """Create the embedding model for the given backend."""
+    if backend == "openai":
+        return OpenAIEmbeddings()
+    if backend == "openai-3-small":
+        return OpenAIBatchEmbeddings()
+    if backend in ("hf", "hf-gpu"):
+        # Local backends are optional — only import when selected
+        import torch
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        if backend == "hf-gpu":
+            device = "cuda"
+        else:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        return HuggingFaceEmbeddings(
+            model_name=HF_EMBEDDING_MODEL,
+            model_kwargs={"device": device},
+            encode_kwargs={"batch_size": 64, "normalize_embeddings": True},
+        )
+    raise ValueError(
+        f"Unsupported embedding backend: {backend}. Use openai, openai-3-small, hf or hf-gpu."
+    )
+
+
 class VectorStoreManager:
-    """Manages FAISS vector store creation and persistence."""
+    """Manages FAISS vector store creation and persistence, sharded by source."""
 
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        embedding_backend: EmbeddingBackend = "openai",
+        compact: bool = False,
+    ):
         # Set as environment variable — avoids Pydantic version conflicts
         os.environ["OPENAI_API_KEY"] = api_key
-        self.embeddings = OpenAIEmbeddings()
-        self.vector_store = None
+        self.embedding_backend = embedding_backend
+        self.embeddings = _make_embeddings(embedding_backend)
+        self.compact = compact
+        # One FAISS store per document source
+        self.stores: Dict[str, FAISS] = {}
+        # (source, SHA-256 of normalized chunk text) for everything already indexed
+        self._seen_hashes: set[Tuple[str, str]] = set()
+        # Compact mode: one IVF-PQ codebook trained across all shards
+        self._pq_template: Optional[faiss.Index] = None
+        # Full-precision vectors per compact shard, kept only while the
+        # codebook is still below IVF_NLIST lists and may be retrained
+        self._pq_raw: Optional[Dict[str, np.ndarray]] = None
+        # IVF shards whose inverted lists are memory-mapped read-only -> backing .faiss file
+        self._mapped: Dict[str, str] = {}
+        # Shards changed since they were last saved to / loaded from _saved_path
+        self._dirty: set[str] = set()
+        self._template_dirty = False
+        self._saved_path: Optional[str] = None
+        # Guards stores and their indexes: searches run against a consistent
+        # set of shards while add/load/clear swap or grow them
+        self._lock = threading.RLock()
 
-    def build(self, documents: List[Document]) -> None:
-        """Build FAISS index from document chunks."""
-        self.vector_store = FAISS.from_documents(documents, self.embeddings)
+    @staticmethod
+    def _content_hash(text: str) -> str:
+        return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
 
-    def add_documents(self, documents: List[Document]) -> None:
-        """Add more documents to an existing index."""
-        if self.vector_store is None:
-            self.build(documents)
-        else:
-            self.vector_store.add_documents(documents)
+    @staticmethod
+    def _source(doc: Document) -> str:
+        return doc.metadata.get("source", "Unknown")
+
+    def _dedupe(self, documents: List[Document]) -> List[Tuple[Tuple[str, str], Document]]:
+        """
+        Drop chunks already in their source's shard (or repeated within this
+        batch). Keyed per source, so boilerplate shared by two filings stays
+        searchable in each. Returns (key, chunk) pairs; add_documents records
+        the keys only once the chunks are indexed, so a failed embedding call
+        can be retried.
+        """
+        unique, batch = [], set()
+        for doc in documents:
+            key = (self._source(doc), self._content_hash(doc.page_content))
+            if key not in self._seen_hashes and key not in batch:
+                batch.add(key)
+                unique.append((key, doc))
+        return unique
+
+    @staticmethod
+    def _train_pq(embeddings: np.ndarray) -> faiss.Index:
+        n, d = embeddings.shape
+        nlist = max(1, min(IVF_NLIST, n // IVF_POINTS_PER_LIST))
+        m = next(m for m in range(min(PQ_M, d), 0, -1) if d % m == 0)
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, m, PQ_NBITS)
+        index.train(embeddings)
+        index.nprobe = min(IVF_NPROBE, nlist)
+        return index
+
+    def _ensure_pq_template(self, new_embeddings: np.ndarray) -> None:
+        """
+        In compact mode, train the shared IVF-PQ codebook once the corpus as a
+        whole (not any single source) has enough vectors, and move the
+        existing HNSW shards onto it.
+        """
+        if not self.compact or self._pq_template is not None:
+            return
+        hnsw = {s: st for s, st in self.stores.items() if isinstance(st.index, faiss.IndexHNSWFlat)}
+        vectors = {s: st.index.reconstruct_n(0, st.index.ntotal) for s, st in hnsw.items()}
+        pool = np.vstack(list(vectors.values()) + [new_embeddings])
+        if len(pool) < PQ_MIN_TRAIN:
+            return
+        self._pq_template = self._train_pq(pool)
+        self._template_dirty = True
+        for source, store in hnsw.items():
+            # Same vectors in the same order, so index_to_docstore_id still holds
+            index = faiss.clone_index(self._pq_template)
+            index.add(vectors[source])
+            store.index = index
+            self._dirty.add(source)
+        self._pq_raw = vectors if self._pq_template.nlist < IVF_NLIST else None
+
+    def _maybe_retrain_pq(self) -> None:
+        """
+        Retrain the compact codebook on the kept full-precision vectors once
+        the corpus has outgrown it, and re-add every shard. Stops once nlist
+        reaches IVF_NLIST; from then on only the compressed shards are kept.
+        """
+        if self._pq_raw is None:
+            return
+        total = sum(len(vectors) for vectors in self._pq_raw.values())
+        nlist = self._pq_template.nlist
+        if total < min(PQ_RETRAIN_GROWTH * IVF_POINTS_PER_LIST * nlist, PQ_FULL_TRAIN):
+            return
+        self._pq_template = self._train_pq(np.vstack(list(self._pq_raw.values())))
+        self._template_dirty = True
+        for source, vectors in self._pq_raw.items():
+            index = faiss.clone_index(self._pq_template)
+            index.add(vectors)
+            self.stores[source].index = index
+            self._mapped.pop(source, None)
+            self._dirty.add(source)
+        if self._pq_template.nlist >= IVF_NLIST:
+            self._pq_raw = None
+
+    def _create_index(self, embeddings: np.ndarray):
+        """HNSW by default; IVF-PQ when compact and there is enough data to train."""
+        if self.compact and self._pq_template is None and len(embeddings) >= PQ_MIN_TRAIN:
+            self._pq_template = self._train_pq(embeddings)
+        if self._pq_template is not None:
+            return faiss.clone_index(self._pq_template)
+
+        index = faiss.IndexHNSWFlat(embeddings.shape[1], HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    @staticmethod
+    def _normalize(embs: np.ndarray) -> np.ndarray:
+        """L2-normalize rows in place (FAISS SIMD kernel) so L2 ranking equals cosine."""
+        faiss.normalize_L2(embs)
+        return embs
+
+    def _embed_documents(self, documents: List[Document]) -> Tuple[List[str], np.ndarray]:
+        texts = [doc.page_content for doc in documents]
+        embs = np.array(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return texts, self._normalize(embs)
+
+    def build(self, documents: List[Document]) -> FAISS:
+        """Build a FAISS store (HNSW, or IVF-PQ when compact) from document chunks."""
+        texts, embs = self._embed_documents(documents)
+        return self._build_store(documents, texts, embs)
+
+    def _build_store(self, documents: List[Document], texts: List[str], embs: np.ndarray) -> FAISS:
+        store = FAISS(
+            embedding_function=self.embeddings,
+            index=self._create_index(embs),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+        store.add_embeddings(
+            zip(texts, embs),
+            metadatas=[doc.metadata for doc in documents],
+        )
+        return store
+
+    def add_documents(self, documents: List[Document]) -> int:
+        """
+        Add documents to the shard for their source, skipping duplicate chunks
+        before they are embedded. Returns number of chunks actually added.
+        """
+        # Concurrent adds are serialized by the caller (FinanceRAGPipeline._lock);
+        # the lock here keeps searches off the shards while they change
+        with self._lock:
+            unique = self._dedupe(documents)
+        if not unique:
+            return 0
+        # One embedding call for the whole batch, then sliced per shard.
+        # Done unlocked so searches aren't held up by the embedding API.
+        texts, embs = self._embed_documents([doc for _, doc in unique])
+
+        by_source: Dict[str, List[int]] = {}
+        for i, (_, doc) in enumerate(unique):
+            by_source.setdefault(self._source(doc), []).append(i)
+
+        with self._lock:
+            self._ensure_pq_template(embs)
+            for source, rows in by_source.items():
+                docs = [unique[i][1] for i in rows]
+                shard_texts, shard_embs = [texts[i] for i in rows], embs[rows]
+                if source not in self.stores:
+                    self.stores[source] = self._build_store(docs, shard_texts, shard_embs)
+                else:
+                    self._materialize(source)
+                    self.stores[source].add_embeddings(
+                        zip(shard_texts, shard_embs),
+                        metadatas=[doc.metadata for doc in docs],
+                    )
+                if self._pq_raw is not None:
+                    kept = self._pq_raw.get(source)
+                    self._pq_raw[source] = shard_embs if kept is None else np.vstack([kept, shard_embs])
+                self._seen_hashes.update(unique[i][0] for i in rows)
+                self._dirty.add(source)
+            self._maybe_retrain_pq()
+        return len(unique)
+
+    @property
+    def chunk_count(self) -> int:
+        with self._lock:
+            return sum(store.index.ntotal for store in self.stores.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self.stores = {}
+            self._seen_hashes = set()
+            self._pq_template = None
+            self._pq_raw = None
+            self._mapped = {}
+            self._dirty = set()
+            self._template_dirty = False
+            self._saved_path = None
+
+    def _materialize(self, source: str) -> None:
+        """Read a memory-mapped shard fully into RAM so it can be written to."""
+        index_file = self._mapped.pop(source, None)
+        if index_file is not None:
+            self.stores[source].index = faiss.read_index(index_file)
 
     def save(self, path: str = "faiss_index") -> None:
-        if self.vector_store:
-            self.vector_store.save_local(path)
+        # faiss.write_index serializes IVF-PQ codebooks and nprobe with the index.
+        # Sources can be arbitrary strings, so shards are stored under hashed
+        # names with a manifest mapping them back.
+        # Only shards changed since the last save/load to this path are
+        # rewritten; the rest (including mapped ones) are already on disk.
+        with self._lock:
+            if not self.stores:
+                return
+            same_path = self._saved_path == path
+            manifest = {}
+            for source, store in self.stores.items():
+                index_name = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+                manifest[source] = index_name
+                if same_path and source not in self._dirty:
+                    continue
+                self._materialize(source)
+                self._write_shard(store, path, index_name)
+                raw_file = os.path.join(path, f"{index_name}.raw.npy")
+                if self._pq_raw is not None:
+                    np.save(raw_file, self._pq_raw[source])
+                elif os.path.exists(raw_file):
+                    os.remove(raw_file)  # codebook is final
+            with open(os.path.join(path, SHARD_MANIFEST), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            if self._pq_template is not None and (self._template_dirty or not same_path):
+                faiss.write_index(self._pq_template, os.path.join(path, PQ_TEMPLATE))
+            self._dirty = set()
+            self._template_dirty = False
+            self._saved_path = path
+
+    @staticmethod
+    def _write_shard(store: FAISS, path: str, index_name: str) -> None:
+        """
+        Write the files FAISS.save_local would, via temp names swapped in with
+        os.replace: a process that still has the old .faiss mapped keeps
+        reading the old inode instead of a truncated file.
+        """
+        os.makedirs(path, exist_ok=True)
+        base = os.path.join(path, index_name)
+        faiss.write_index(store.index, f"{base}.faiss.tmp")
+        with open(f"{base}.pkl.tmp", "wb") as f:
+            pickle.dump((store.docstore, store.index_to_docstore_id), f)
+        os.replace(f"{base}.faiss.tmp", f"{base}.faiss")
+        os.replace(f"{base}.pkl.tmp", f"{base}.pkl")
 
     def load(self, path: str = "faiss_index") -> None:
-        self.vector_store = FAISS.load_local(
-            path, self.embeddings, allow_dangerous_deserialization=True
-        )
+        with self._lock:
+            manifest_path = os.path.join(path, SHARD_MANIFEST)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+            else:
+                manifest = {"Unknown": "index"}  # single-index layout from before sharding
+            # Same files FAISS.save_local writes, but the index is mapped, not read
+            self.stores = {}
+            self._mapped = {}
+            for source, index_name in manifest.items():
+                index_file = os.path.join(path, f"{index_name}.faiss")
+                with open(os.path.join(path, f"{index_name}.pkl"), "rb") as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+                index = faiss.read_index(index_file, MMAP_FLAGS)
+                self.stores[source] = FAISS(
+                    embedding_function=self.embeddings,
+                    index=index,
+                    docstore=docstore,
+                    index_to_docstore_id=index_to_docstore_id,
+                )
+                if isinstance(index, faiss.IndexIVF):
+                    # Other index types ignore IO_FLAG_MMAP and are already in RAM
+                    self._mapped[source] = index_file
+            template_path = os.path.join(path, PQ_TEMPLATE)
+            self._pq_template = faiss.read_index(template_path) if os.path.exists(template_path) else None
+            raw_files = {
+                source: os.path.join(path, f"{index_name}.raw.npy") for source, index_name in manifest.items()
+            }
+            if self._pq_template is not None and all(os.path.exists(f) for f in raw_files.values()):
+                self._pq_raw = {source: np.load(f) for source, f in raw_files.items()}
+            else:
+                self._pq_raw = None  # final codebook, or saved before vectors were kept
+            self._seen_hashes = {
+                (source, self._content_hash(doc.page_content))
+                for source, store in self.stores.items()
+                for doc in store.docstore._dict.values()
+            }
+            self._dirty = set()
+            self._template_dirty = False
+            self._saved_path = path
+
+    def search(self, query: str, k: int, sources: Optional[List[str]] = None) -> List[Document]:
+        """
+        Search the selected shards (all by default) in parallel and merge the
+        top-k by distance. The query is embedded once and shared by every shard.
+        """
+        embedding = np.array([self.embeddings.embed_query(query)], dtype=np.float32)
+        return self.search_by_vector(self._normalize(embedding)[0], k, sources)
+
+    def search_by_vector(
+        self, embedding: np.ndarray, k: int, sources: Optional[List[str]] = None
+    ) -> List[Document]:
+        """Like search(), for a query that is already embedded and L2-normalized."""
+        with self._lock:
+            return self._search_shards(embedding, k, sources)
+
+    def _search_shards(
+        self, embedding: np.ndarray, k: int, sources: Optional[List[str]] = None
+    ) -> List[Document]:
+        shards = [self.stores[s] for s in (sources or self.stores) if s in self.stores]
+        if not shards:
+            return []
+        embedding = embedding.tolist()
+
+        def search_shard(store: FAISS):
+            return store.similarity_search_with_score_by_vector(embedding, k)
+
+        if len(shards) == 1:
+            results = [search_shard(shards[0])]
+        else:
+            # FAISS releases the GIL while searching, so threads run shards in parallel
+            with ThreadPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1)) as ex:
+                results = list(ex.map(search_shard, shards))
+        hits = sorted((hit for result in results for hit in result), key=lambda hit: hit[1])
+        return [doc for doc, _ in hits[:k]]
 
-    def get_retriever(self, k: int = 5):
-        if self.vector_store is None:
+    def get_retriever(self, k: int = 5, ef_search: int = None, sources: Optional[List[str]] = None):
+        if not self.stores:
             raise ValueError("Vector store not initialized. Please load documents first.")
-        return self.vector_store.as_retriever(search_kwargs={"k": k})
+        if ef_search is not None:
+            # Higher efSearch = better recall, slower queries
+            for store in self.stores.values():
+                if hasattr(store.index, "hnsw"):
+                    store.index.hnsw.efSearch = ef_search
+        return ShardedRetriever(manager=self, k=k, sources=sources)
+
+
+class ShardedRetriever(BaseRetriever):
+    """Retriever over VectorStoreManager's per-source shards."""
+
+    manager: Any
+    k: int = 5
+    sources: Optional[List[str]] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.manager.search(query, self.k, self.sources)
 
 
 # ──────────────────────────────────────────────
 # RAG PIPELINE
 # ──────────────────────────────────────────────
+TOP_K = 5
+# With reranking, fetch a wider pool from FAISS and let the cross-encoder pick TOP_K
+RERANK_CANDIDATES = 25
+RERANK_MODEL = "BAAI/bge-reranker-base"
+
+
+@lru_cache(maxsize=1)
+def _get_cross_encoder(model_name: str = RERANK_MODEL):
+    """Load the reranker once per process. Requires sentence-transformers."""
+    from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+
+    return HuggingFaceCrossEncoder(model_name=model_name)
+
+
 class FinanceRAGPipeline:
     """
     End-to-end RAG pipeline for financial document Q&A.
@@ -131,44 +1011,174 @@ class FinanceRAGPipeline:
         print(result["answer"])
     """
 
-    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo", temperature: float = 0.0):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.0,
+        embedding_backend: EmbeddingBackend = "openai",
+        compact: bool = False,
+        rerank: bool = False,
+    ):
         # Set as environment variable — avoids Pydantic version conflicts
         os.environ["OPENAI_API_KEY"] = api_key
         self.api_key = api_key
+        self.rerank = rerank
         self.processor = DocumentProcessor()
-        self.vector_manager = VectorStoreManager(api_key)
+        self.vector_manager = VectorStoreManager(api_key, embedding_backend, compact)
         self.llm = ChatOpenAI(
             model_name=model,
             temperature=temperature,
+            streaming=True,
         )
+        # Stuff-documents chain that answers from retrieved chunks; built on first query
         self.qa_chain = None
+        self.reranker = (
+            CrossEncoderReranker(model=_get_cross_encoder(), top_n=TOP_K) if rerank else None
+        )
         self.document_count = 0
+        # Bumped by reset(); sessions sharing the pipeline compare against it
+        self.reset_count = 0
+        # A cached pipeline is shared by every Streamlit session (one thread
+        # each); serialize the calls that mutate or persist the index
+        self._lock = threading.RLock()
+        # Semantic query cache: normalized question embeddings → answers, by id.
+        # Sessions query concurrently, so lookups and updates share one lock;
+        # the generation is bumped on every clear
+        self.qcache_index = None
+        self.qcache_answers: Dict[int, dict] = {}
+        self._qcache_lock = threading.Lock()
+        self._qcache_generation = 0
 
-    def _build_chain(self) -> None:
-        retriever = self.vector_manager.get_retriever(k=5)
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": FINANCE_PROMPT},
-        )
+    def _clear_query_cache(self) -> None:
+        with self._qcache_lock:
+            self.qcache_index = None
+            self.qcache_answers = {}
+            self._qcache_generation += 1
+
+    def _answer_chain(self):
+        # Retrieval happens in _retrieve(), so the chain only stuffs and answers
+        # and does not depend on the index — build it once
+        if self.qa_chain is None:
+            self.qa_chain = load_qa_chain(self.llm, chain_type="stuff", prompt=FINANCE_PROMPT)
+        return self.qa_chain
+
+    def _check_documents(self) -> None:
+        if not self.vector_manager.stores:
+            raise ValueError("No documents ingested. Please upload a financial document first.")
+
+    def _add_chunks(self, docs: List[Document]) -> int:
+        with self._lock:
+            added = self.vector_manager.add_documents(docs)
+            if added:
+                self.document_count += added
+                self._clear_query_cache()
+            return added
 
     def ingest_file(self, file_path: str) -> int:
         """Load a file into the vector store. Returns number of chunks created."""
-        docs = self.processor.load_file(file_path)
-        self.vector_manager.add_documents(docs)
-        self.document_count += len(docs)
-        self._build_chain()
-        return len(docs)
+        return self.ingest_files([file_path])
+
+    @staticmethod
+    def _parse_pdfs(worker, args: List[tuple]) -> List[Document]:
+        """Run a PDF worker over args, in a process pool when there is more than one."""
+        if len(args) > 1:
+            workers = min(os.cpu_count() or 1, 4, len(args))
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.starmap(worker, args)
+        else:
+            results = [worker(*a) for a in args]
+        return [doc for result in results for doc in result]
+
+    def ingest_files(self, paths: List[str]) -> int:
+        """
+        Load a batch of files into the vector store. PDFs are parsed in
+        parallel worker processes; all chunks are embedded in one call.
+        Returns total number of chunks created.
+        """
+        pdf_paths = [p for p in paths if Path(p).suffix.lower() == ".pdf"]
+        other_paths = [p for p in paths if Path(p).suffix.lower() != ".pdf"]
+
+        docs = self._parse_pdfs(_parse_pdf_worker, [(p, self.processor) for p in pdf_paths])
+        for path in other_paths:
+            docs.extend(self.processor.load_file(path))
+
+        return self._add_chunks(docs)
+
+    def ingest_bytes(self, files: List[Tuple[str, bytes]]) -> int:
+        """
+        Like ingest_files(), but for in-memory (name, data) pairs such as
+        Streamlit uploads — nothing is written to disk.
+        """
+        pdf_files = [(n, d) for n, d in files if Path(n).suffix.lower() == ".pdf"]
+        other_files = [(n, d) for n, d in files if Path(n).suffix.lower() != ".pdf"]
+
+        docs = self._parse_pdfs(
+            _parse_pdf_bytes_worker, [(d, n, self.processor) for n, d in pdf_files]
+        )
+        for name, data in other_files:
+            docs.extend(self.processor.load_bytes(data, name))
+
+        return self._add_chunks(docs)
 
     def ingest_text(self, text: str, source_name: str = "pasted_text") -> int:
         """Load raw text into the vector store."""
         docs = self.processor.load_raw_text(text, source_name)
-        self.vector_manager.add_documents(docs)
-        self.document_count += len(docs)
-        self._build_chain()
-        return len(docs)
+        return self._add_chunks(docs)
+
+    def _cached_answer(self, q_emb: np.ndarray) -> Tuple[Optional[dict], int]:
+        """
+        Return a previous answer for a near-identical question, if any, and
+        the cache generation to pass to _cache_answer() on a miss.
+        """
+        with self._qcache_lock:
+            generation = self._qcache_generation
+            if self.qcache_index is None:
+                return None, generation
+            scores, ids = self.qcache_index.search(q_emb, 1)
+            if scores[0][0] >= QCACHE_THRESHOLD:
+                return self.qcache_answers[int(ids[0][0])], generation
+            return None, generation
+
+    def _cache_answer(self, q_emb: np.ndarray, answer: dict, generation: int) -> None:
+        with self._qcache_lock:
+            if generation != self._qcache_generation:
+                return  # computed before a concurrent ingest cleared the cache
+            if self.qcache_index is None:
+                self.qcache_index = faiss.IndexIDMap(faiss.IndexFlatIP(q_emb.shape[1]))
+            answer_id = len(self.qcache_answers)
+            self.qcache_index.add_with_ids(q_emb, np.array([answer_id], dtype=np.int64))
+            self.qcache_answers[answer_id] = answer
+
+    def _finish_query(self, result: dict) -> dict:
+        sources = list({
+            doc.metadata.get("source", "Unknown")
+            for doc in result.get("source_documents", [])
+        })
+        answer = {
+            "answer": result["result"],
+            "sources": sources,
+            # Document references already held by the docstore — callers
+            # truncate for display, so nothing is copied per query
+            "chunks": result.get("source_documents", []),
+        }
+        return answer
+
+    @staticmethod
+    def _question_vector(embedding: List[float]) -> np.ndarray:
+        q_emb = np.array([embedding], dtype=np.float32)
+        faiss.normalize_L2(q_emb)
+        return q_emb
+
+    def _retrieve(self, question: str, q_emb: np.ndarray) -> List[Document]:
+        """
+        Fetch context for a question using the vector the query cache already
+        computed, so a cache miss costs one embed_query call, not two.
+        """
+        if self.reranker is not None:
+            docs = self.vector_manager.search_by_vector(q_emb[0], RERANK_CANDIDATES)
+            return list(self.reranker.compress_documents(docs, question))
+        return self.vector_manager.search_by_vector(q_emb[0], TOP_K)
 
     def query(self, question: str) -> dict:
         """
@@ -178,36 +1188,110 @@ class FinanceRAGPipeline:
             {
                 "answer": str,
                 "sources": List[str],
-                "chunks": List[str]
+                "chunks": List[Document]
             }
         """
-        if self.qa_chain is None:
-            raise ValueError("No documents ingested. Please upload a financial document first.")
+        self._check_documents()
 
-        result = self.qa_chain.invoke({"query": question})
+        q_emb = self._question_vector(self.vector_manager.embeddings.embed_query(question))
+        cached, generation = self._cached_answer(q_emb)
+        if cached is not None:
+            return cached
 
-        sources = list({
-            doc.metadata.get("source", "Unknown")
-            for doc in result.get("source_documents", [])
-        })
-        chunks = [doc.page_content[:300] for doc in result.get("source_documents", [])]
+        docs = self._retrieve(question, q_emb)
+        answer = self._answer_chain().invoke(
+            {"input_documents": docs, "question": question}
+        )
+        result = self._finish_query({"result": answer["output_text"], "source_documents": docs})
+        self._cache_answer(q_emb, result, generation)
+        return result
 
-        return {
-            "answer": result["result"],
-            "sources": sources,
-            "chunks": chunks,
-        }
+    async def aquery(self, question: str) -> dict:
+        """Async version of query(); same return shape."""
+        self._check_documents()
+
+        q_emb = self._question_vector(
+            await self.vector_manager.embeddings.aembed_query(question)
+        )
+        cached, generation = self._cached_answer(q_emb)
+        if cached is not None:
+            return cached
+
+        # FAISS and the cross-encoder are blocking; keep them off the event loop
+        docs = await asyncio.to_thread(self._retrieve, question, q_emb)
+        answer = await self._answer_chain().ainvoke(
+            {"input_documents": docs, "question": question}
+        )
+        result = self._finish_query({"result": answer["output_text"], "source_documents": docs})
+        self._cache_answer(q_emb, result, generation)
+        return result
+
+    def stream_query(self, question: str) -> Tuple[dict, Iterator[str]]:
+        """
+        Streaming version of query(). Retrieval runs up front; the answer is
+        generated lazily so the UI can render tokens as they arrive.
+
+        Returns:
+            (result, tokens) — result has "sources" and "chunks" straight away
+            and gains "answer" once the tokens iterator is exhausted.
+        """
+        self._check_documents()
+
+        q_emb = self._question_vector(self.vector_manager.embeddings.embed_query(question))
+        cached, generation = self._cached_answer(q_emb)
+        if cached is not None:
+            return dict(cached), iter([cached["answer"]])
+
+        docs = self._retrieve(question, q_emb)
+        result = self._finish_query({"result": "", "source_documents": docs})
+
+        def tokens() -> Iterator[str]:
+            prompt = FINANCE_PROMPT.format(
+                context="\n\n".join(doc.page_content for doc in docs),
+                question=question,
+            )
+            parts = []
+            for chunk in self.llm.stream(prompt):
+                parts.append(chunk.content)
+                yield chunk.content
+            result["answer"] = "".join(parts)
+            self._cache_answer(q_emb, result, generation)
+
+        return result, tokens()
+
+    async def _aquery_many(self, questions: List[str]) -> List[dict]:
+        return await asyncio.gather(*(self.aquery(q) for q in questions))
+
+    def query_many(self, questions: List[str]) -> List[dict]:
+        """Run several queries concurrently. Results are in the same order as questions."""
+        return asyncio.run(self._aquery_many(questions))
 
     def save_index(self, path: str = "faiss_index") -> None:
-        self.vector_manager.save(path)
+        with self._lock:
+            self.vector_manager.save(path)
 
     def load_index(self, path: str = "faiss_index") -> None:
-        self.vector_manager.load(path)
-        self._build_chain()
+        with self._lock:
+            self.vector_manager.load(path)
+            self.document_count = self.vector_manager.chunk_count
+            self._clear_query_cache()
 
-    def reset(self) -> None:
-        """Clear all ingested documents."""
-        self.vector_manager.vector_store = None
-        self.qa_chain = None
-        self.document_count = 0
+    def reset(self, path: Optional[str] = None) -> None:
+        """
+        Clear all ingested documents and release the memory they held. With
+        path, also delete the index saved there so it is not reloaded.
+        """
+        with self._lock:
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+            self.vector_manager.clear()
+            self.document_count = 0
+            self.reset_count += 1
+            self._clear_query_cache()
+        # FAISS wrappers and docstores sit in reference cycles; collect now
+        # rather than whenever the GC next runs
+        gc.collect()
+        torch = sys.modules.get("torch")  # only loaded by the local HF backends
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
         
\ No newline at end of file
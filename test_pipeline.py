@@ -6,12 +6,69 @@ Run with: pytest test_pipeline.py -v
 """
 
 import pytest
+import hashlib
 import os
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
+import faiss
+import numpy as np
 from langchain.schema import Document
+from langchain_community.cross_encoders import FakeCrossEncoder
+from langchain_community.embeddings import DeterministicFakeEmbedding
 
-from rag_pipeline import DocumentProcessor, FinanceRAGPipeline
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import rag_pipeline
+from rag_pipeline import (
+    CompiledSeparatorSplitter,
+    DocumentProcessor,
+    FinanceRAGPipeline,
+    FinanceSectionChunker,
+    OpenAIBatchEmbeddings,
+    VectorStoreManager,
+    merge_small_chunks,
+)
+
+
+def shard_name(source):
+    """Hashed file stem VectorStoreManager.save uses for a source's shard."""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+def word_len(text):
+    """Offline stand-in for tiktoken token counts."""
+    return len(text.split())
+
+
+@pytest.fixture(autouse=True)
+def offline_token_counts(monkeypatch):
+    # tiktoken downloads its BPE file on first use; count words instead
+    monkeypatch.setattr(rag_pipeline, "tiktoken_len", word_len)
+
+
+def make_pdf(lines):
+    """Build a minimal one-page PDF with the given text lines."""
+    stream = "BT /F1 12 Tf 72 720 Td " + " ".join(f"({l}) Tj 0 -14 Td" for l in lines) + " ET"
+    objs = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
 
 
 # ──────────────────────────────────────────────
@@ -49,11 +106,386 @@ class TestDocumentProcessor:
         finally:
             os.unlink(tmp_path)
 
+    def test_compiled_splitter_matches_langchain(self):
+        text = (
+            "Item 7. MD&A\n\nRevenue rose 12% to $4.1B. Margins expanded.\n"
+            "Operating expenses were flat year over year. " * 60
+        )
+        for keep_separator in (True, False, "end"):
+            kwargs = dict(
+                chunk_size=300,
+                chunk_overlap=30,
+                separators=["\n\n", "\n", ".", " "],
+                keep_separator=keep_separator,
+            )
+            expected = RecursiveCharacterTextSplitter(**kwargs).split_text(text)
+            assert CompiledSeparatorSplitter(**kwargs).split_text(text) == expected
+
+    @patch("rag_pipeline.PyPDFLoader")
+    def test_load_pdf_splits_pages_lazily(self, mock_loader):
+        pages = [
+            Document(page_content=f"Page {i} net income was $1.{i}B. " * 40, metadata={"source": "10k.pdf", "page": i})
+            for i in range(3)
+        ]
+        mock_loader.return_value.lazy_load.return_value = iter(pages)
+        processor = DocumentProcessor(chunk_size=500, chunk_overlap=50, section_aware=False)
+        docs = processor.load_pdf("10k.pdf")
+        assert len(docs) > len(pages)
+        assert {d.metadata["page"] for d in docs} == {0, 1, 2}
+        mock_loader.return_value.load.assert_not_called()
+
+    def test_load_pdf_bytes(self):
+        data = make_pdf(["Apple net revenue was $81.8 billion."] * 5)
+        docs = self.processor.load_pdf_bytes(data, "aapl_q3.pdf")
+        assert len(docs) > 0
+        assert "81.8" in docs[0].page_content
+        assert docs[0].metadata["source"] == "aapl_q3.pdf"
+        assert docs[0].metadata["page"] == 0
+
+    def test_load_pdf_bytes_tags_sections(self):
+        data = make_pdf(
+            ["Item 7. Management Discussion and Analysis"]
+            + ["Net sales increased 8% driven by Services and Mac."] * 20
+        )
+        docs = self.processor.load_pdf_bytes(data, "aapl_10k.pdf")
+        assert docs[0].metadata["section"].startswith("Item 7.")
+
+    def test_small_trailing_chunk_merged_without_duplicate_overlap(self):
+        text = "Operating income rose to $4.2B on higher volumes. " * 10 + "Outlook unchanged."
+        docs = self.processor.load_raw_text(text, source_name="q4_release")
+        assert len(docs) == 1
+        assert docs[0].page_content.count("Outlook unchanged.") == 1
+        assert docs[0].page_content.count("Operating income") == 10
+        assert docs[0].metadata["source"] == "q4_release"
+
+    def test_merge_without_offsets_keeps_repeated_words(self):
+        docs = [
+            Document(page_content="Segment results by Revenue", metadata={"source": "q3"}),
+            Document(page_content="Revenue declined 4% in Q3.", metadata={"source": "q3"}),
+        ]
+        merged = merge_small_chunks(docs, min_tokens=80, length_function=word_len)
+        assert merged[0].page_content == "Segment results by Revenue\nRevenue declined 4% in Q3."
+
+    def test_merge_respects_size_cap(self):
+        long_text = "Tesla earnings increased by 20% year over year. " * 100
+        docs = self.processor.load_raw_text(long_text)
+        assert len(docs) > 1
+        for doc in docs:
+            assert len(doc.page_content) <= 550
+
+    def test_splitter_shared_between_processors(self):
+        assert DocumentProcessor(500, 50).splitter is self.processor.splitter
+        assert DocumentProcessor(800, 50).splitter is not self.processor.splitter
+
     def test_unsupported_file_type_raises(self):
         with pytest.raises(ValueError, match="Unsupported file type"):
             self.processor.load_file("report.xlsx")
 
 
+# ──────────────────────────────────────────────
+# SECTION CHUNKER TESTS
+# ──────────────────────────────────────────────
+class TestFinanceSectionChunker:
+
+    def setup_method(self):
+        self.chunker = FinanceSectionChunker(
+            target_tokens=100, table_max_tokens=60, min_tokens=10, length_function=word_len
+        )
+
+    def test_sections_start_new_chunks(self):
+        blocks = [
+            ("Item 1. Business\n" + "Apple designs smartphones and wearables.\n" * 10, {"page": 0}, False),
+            ("Item 1A. Risk Factors\n" + "Supply chain disruption could harm results.\n" * 10, {"page": 1}, False),
+        ]
+        docs = self.chunker.split(blocks)
+        assert [d.metadata["section"] for d in docs] == ["Item 1. Business", "Item 1A. Risk Factors"]
+        assert [d.metadata["page"] for d in docs] == [0, 1]
+
+    def test_long_section_splits_near_target(self):
+        blocks = [("Item 7. MD&A\n" + "Revenue grew on strong iPhone and Services demand.\n" * 60, {"page": 0}, False)]
+        docs = self.chunker.split(blocks)
+        assert len(docs) > 1
+        assert all(word_len(d.page_content) <= 100 for d in docs)
+
+    def test_oversized_line_is_split(self):
+        paragraph = "Net sales rose 8% on strong iPhone demand. " * 50  # one 400-word line
+        docs = self.chunker.split([("Item 7. MD&A\n" + paragraph, {"page": 2}, False)])
+        assert len(docs) > 1
+        assert all(word_len(d.page_content) <= 100 for d in docs)
+        assert all(d.metadata["section"] == "Item 7. MD&A" for d in docs)
+
+    def test_short_remainder_does_not_repeat_overlap(self):
+        lines = "\n".join(f"Revenue grew {i} percent." for i in range(25))
+        docs = self.chunker.split([("Item 7. MD&A\n" + lines, {"page": 0}, False)])
+        assert len(docs) == 1
+        assert all(docs[0].page_content.count(f"grew {i} percent.") == 1 for i in range(25))
+
+    def test_line_splitter_shared_between_chunkers(self):
+        same = FinanceSectionChunker(target_tokens=100, length_function=word_len)
+        assert same.line_splitter is self.chunker.line_splitter
+        assert FinanceSectionChunker(target_tokens=200, length_function=word_len).line_splitter is not same.line_splitter
+        assert DocumentProcessor().chunker.line_splitter is DocumentProcessor().chunker.line_splitter
+
+    def test_tables_are_atomic_and_capped(self):
+        small = "Segment | 2023\niPhone | 200\nMac | 29"
+        large = "Segment | 2023 | 2022\n" + "Services | 85 | 78\n" * 40
+        docs = self.chunker.split([
+            ("Item 8. Financial Statements\n" + "The tables below summarize results.\n" * 5, {"page": 3}, False),
+            (small, {"page": 3}, True),
+            (large, {"page": 3}, True),
+        ])
+        tables = [d for d in docs if d.metadata["is_table"]]
+        assert tables[0].page_content == small
+        assert len(tables) > 2
+        assert all(t.page_content.startswith("Segment") for t in tables)
+        assert all(word_len(t.page_content) <= 60 for t in tables[1:])
+
+    def test_small_chunks_are_merged(self):
+        blocks = [
+            ("PART II\n", {"page": 0}, False),
+            ("Item 5. Market\n" + "Shares trade on Nasdaq under the symbol AAPL.\n" * 5, {"page": 0}, False),
+        ]
+        docs = self.chunker.split(blocks)
+        assert len(docs) == 1
+        assert docs[0].page_content.startswith("PART II")
+
+
+# ──────────────────────────────────────────────
+# VECTOR STORE TESTS (fake embeddings)
+# ──────────────────────────────────────────────
+class TestVectorStoreManager:
+
+    def setup_method(self):
+        with patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32)):
+            self.manager = VectorStoreManager(api_key="sk-test-key")
+        self.docs = [
+            Document(page_content=f"Segment {i} revenue was ${i}B.", metadata={"source": f"report_{i % 2}"})
+            for i in range(20)
+        ]
+
+    def test_hnsw_shards_load_into_ram(self):
+        self.manager.add_documents(self.docs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.manager.save(tmp_dir)
+            self.manager.load(tmp_dir)
+            assert self.manager._mapped == {}
+            assert self.manager.add_documents(
+                [Document(page_content="Segment X revenue was $9B.", metadata={"source": "report_0"})]
+            ) == 1
+            self.manager.save(tmp_dir)
+            assert not any(name.endswith(".tmp") for name in os.listdir(tmp_dir))
+            self.manager.load(tmp_dir)
+        assert self.manager.chunk_count == len(self.docs) + 1
+
+    def test_save_rewrites_only_changed_shards(self):
+        self.manager.add_documents(self.docs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.manager.save(tmp_dir)
+            files = {name: os.stat(os.path.join(tmp_dir, name)).st_mtime_ns for name in os.listdir(tmp_dir)}
+            self.manager.add_documents(
+                [Document(page_content="Segment X revenue was $9B.", metadata={"source": "report_0"})]
+            )
+            with patch.object(VectorStoreManager, "_write_shard", wraps=VectorStoreManager._write_shard) as write:
+                self.manager.save(tmp_dir)
+            assert [c.args[2] for c in write.call_args_list] == [shard_name("report_0")]
+            unchanged = shard_name("report_1")
+            for ext in (".faiss", ".pkl"):
+                name = unchanged + ext
+                assert os.stat(os.path.join(tmp_dir, name)).st_mtime_ns == files[name]
+
+            # A different directory gets every shard
+            with tempfile.TemporaryDirectory() as other_dir:
+                self.manager.save(other_dir)
+                self.manager.load(other_dir)
+            assert self.manager.chunk_count == len(self.docs) + 1
+
+    def test_search_while_adding(self):
+        self.manager.add_documents(self.docs)
+        batches = [
+            [Document(page_content=f"Region {j}-{i} sales were ${i}M.", metadata={"source": f"region_{j}"})
+             for i in range(10)]
+            for j in range(6)
+        ]
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            adds = [ex.submit(self.manager.add_documents, batch) for batch in batches]
+            searches = [ex.submit(self.manager.search, "Segment 3 revenue was $3B.", 3) for _ in range(20)]
+            assert sum(f.result() for f in adds) == 60
+            assert all(len(f.result()) == 3 for f in searches)
+        assert self.manager.chunk_count == len(self.docs) + 60
+
+    def test_build_uses_hnsw_index(self):
+        store = self.manager.build(self.docs)
+        assert isinstance(store.index, faiss.IndexHNSWFlat)
+        assert store.index.ntotal == len(self.docs)
+
+    def test_retriever_returns_exact_match(self):
+        self.manager.add_documents(self.docs)
+        retriever = self.manager.get_retriever(k=3, ef_search=128)
+        results = retriever.invoke("Segment 7 revenue was $7B.")
+        assert results[0].page_content == "Segment 7 revenue was $7B."
+        assert len(results) == 3
+        assert all(s.index.hnsw.efSearch == 128 for s in self.manager.stores.values())
+
+    def test_documents_sharded_by_source(self):
+        self.manager.add_documents(self.docs)
+        assert set(self.manager.stores) == {"report_0", "report_1"}
+        assert self.manager.chunk_count == len(self.docs)
+
+        retriever = self.manager.get_retriever(k=5, sources=["report_1"])
+        results = retriever.invoke("Segment 4 revenue was $4B.")
+        assert len(results) == 5
+        assert all(d.metadata["source"] == "report_1" for d in results)
+
+    def test_added_vectors_are_unit_norm(self):
+        self.manager.add_documents(self.docs[:10])
+        self.manager.add_documents(self.docs[10:])
+        for store in self.manager.stores.values():
+            index = store.index
+            vectors = np.vstack([index.reconstruct(i) for i in range(index.ntotal)])
+            assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+
+    def test_duplicate_chunks_are_skipped(self):
+        assert self.manager.add_documents(self.docs) == len(self.docs)
+        reupload = [Document(page_content="  " + d.page_content + "\n", metadata=d.metadata) for d in self.docs]
+        assert self.manager.add_documents(reupload) == 0
+        assert self.manager.chunk_count == len(self.docs)
+
+    def test_failed_embedding_can_be_retried(self):
+        with patch.object(self.manager, "_embed_documents", side_effect=TimeoutError("429")):
+            with pytest.raises(TimeoutError):
+                self.manager.add_documents(self.docs)
+        assert self.manager.stores == {}
+        assert self.manager.add_documents(self.docs) == len(self.docs)
+        assert self.manager.chunk_count == len(self.docs)
+
+    def test_compact_uses_ivfpq_and_survives_save(self):
+        self.manager.compact = True
+        docs = [
+            Document(page_content=f"Filing {i}: operating margin {i % 40}%.", metadata={"source": "sec/10-K 2023.pdf"})
+            for i in range(300)
+        ] + self.docs
+        self.manager.add_documents(docs)
+        assert isinstance(self.manager.stores["sec/10-K 2023.pdf"].index, faiss.IndexIVFPQ)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.manager.save(tmp_dir)
+            self.manager.load(tmp_dir)
+        assert set(self.manager.stores) == {"sec/10-K 2023.pdf", "report_0", "report_1"}
+        assert isinstance(self.manager.stores["sec/10-K 2023.pdf"].index, faiss.IndexIVFPQ)
+        assert self.manager.chunk_count == len(docs)
+
+    def test_loaded_compact_shard_is_mapped_and_appendable(self):
+        self.manager.compact = True
+        docs = [
+            Document(page_content=f"Filing {i}: operating margin {i % 40}%.", metadata={"source": "10-K"})
+            for i in range(300)
+        ]
+        self.manager.add_documents(docs + self.docs)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.manager.save(tmp_dir)
+            self.manager.load(tmp_dir)
+            assert set(self.manager._mapped) == {"10-K", "report_0", "report_1"}
+            assert self.manager.search("Filing 7: operating margin 7%.", k=1)[0].page_content == docs[7].page_content
+
+            # A second reader mapping the same files, e.g. another process
+            with patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32)):
+                reader = VectorStoreManager(api_key="sk-test-key")
+            reader.load(tmp_dir)
+
+            # Appending to a read-only mapped shard reads it into RAM first
+            extra = [Document(page_content="Filing X: buyback of $2B.", metadata={"source": "10-K"})]
+            assert self.manager.add_documents(extra) == 1
+            assert "10-K" not in self.manager._mapped
+
+            # Re-saving in place keeps the untouched mapped shards intact and
+            # swaps the rewritten one in without truncating the reader's mapping
+            self.manager.save(tmp_dir)
+            assert reader.search("Filing 7: operating margin 7%.", k=1)[0].page_content == docs[7].page_content
+            self.manager.load(tmp_dir)
+            assert self.manager.chunk_count == len(docs) + len(self.docs) + 1
+
+    def test_compact_codebook_shared_across_small_sources(self):
+        self.manager.compact = True
+        for filing in ("aapl_10k", "msft_10k", "nvda_10k"):
+            self.manager.add_documents([
+                Document(page_content=f"{filing} note {i}: margin {i % 40}%.", metadata={"source": filing})
+                for i in range(100)
+            ])
+        # No single source reaches PQ_MIN_TRAIN, but together they do
+        assert all(isinstance(s.index, faiss.IndexIVFPQ) for s in self.manager.stores.values())
+        assert self.manager.chunk_count == 300
+        hit = self.manager.search("aapl_10k note 7: margin 7%.", k=1)[0]
+        assert hit.metadata["source"] == "aapl_10k"
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.manager.save(tmp_dir)
+            self.manager.load(tmp_dir)
+            self.manager.add_documents(self.docs)
+        assert isinstance(self.manager.stores["report_0"].index, faiss.IndexIVFPQ)
+
+    def test_compact_codebook_retrained_as_corpus_grows(self):
+        self.manager.compact = True
+
+        def batch(b):
+            return [
+                Document(page_content=f"Batch {b} note {i}: margin {i % 40}%.", metadata={"source": f"filing_{b}"})
+                for i in range(300)
+            ]
+
+        self.manager.add_documents(batch(0))
+        first_nlist = self.manager._pq_template.nlist
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # The kept full-precision vectors survive a restart
+            self.manager.save(tmp_dir)
+            self.manager.load(tmp_dir)
+            for b in range(1, 4):
+                self.manager.add_documents(batch(b))
+        assert self.manager._pq_template.nlist > first_nlist
+        assert all(s.index.nlist == self.manager._pq_template.nlist for s in self.manager.stores.values())
+        assert self.manager.chunk_count == 1200
+        hit = self.manager.search("Batch 2 note 7: margin 7%.", k=1)[0]
+        assert hit.page_content == "Batch 2 note 7: margin 7%."
+
+    def test_shared_boilerplate_indexed_per_source(self):
+        boilerplate = "Forward-looking statements involve risks and uncertainties."
+        self.manager.add_documents([
+            Document(page_content=boilerplate, metadata={"source": source}) for source in ("aapl", "msft")
+        ])
+        results = self.manager.search(boilerplate, k=1, sources=["msft"])
+        assert results[0].page_content == boilerplate
+        assert results[0].metadata["source"] == "msft"
+
+    def test_compact_small_corpus_stays_hnsw(self):
+        self.manager.compact = True
+        store = self.manager.build(self.docs)
+        assert isinstance(store.index, faiss.IndexHNSWFlat)
+
+
+# ──────────────────────────────────────────────
+# EMBEDDINGS TESTS (mocked OpenAI client)
+# ──────────────────────────────────────────────
+class TestOpenAIBatchEmbeddings:
+
+    @patch("rag_pipeline.AsyncOpenAI")
+    @patch("rag_pipeline.OpenAI")
+    def test_embed_documents_batches_requests(self, mock_client, mock_async_client):
+        def fake_create(input, model, dimensions):
+            # Return items out of order to check they are re-sorted by index
+            data = [MagicMock(index=i, embedding=[float(text.split()[-1])]) for i, text in enumerate(input)]
+            return MagicMock(data=list(reversed(data)))
+
+        mock_client.return_value.embeddings.create.side_effect = fake_create
+        embeddings = OpenAIBatchEmbeddings(batch_size=4)
+        vectors = embeddings.embed_documents([f"chunk {i}" for i in range(10)])
+
+        assert vectors == [[float(i)] for i in range(10)]
+        calls = mock_client.return_value.embeddings.create.call_args_list
+        assert [len(c.kwargs["input"]) for c in calls] == [4, 4, 2]
+        assert all(c.kwargs["model"] == "text-embedding-3-small" for c in calls)
+        assert all(c.kwargs["dimensions"] == 512 for c in calls)
+
+
 # ──────────────────────────────────────────────
 # PIPELINE TESTS (mocked OpenAI)
 # ──────────────────────────────────────────────
@@ -66,11 +498,9 @@ class TestFinanceRAGPipeline:
         assert pipeline.document_count == 0
         assert pipeline.qa_chain is None
 
-    @patch("rag_pipeline.OpenAIEmbeddings")
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
     @patch("rag_pipeline.ChatOpenAI")
-    @patch("rag_pipeline.FAISS")
-    def test_ingest_text_updates_count(self, mock_faiss, mock_llm, mock_emb):
-        mock_faiss.from_documents.return_value = MagicMock()
+    def test_ingest_text_updates_count(self, mock_llm, mock_emb):
         pipeline = FinanceRAGPipeline(api_key="sk-test-key")
 
         long_text = "Revenue grew 15% in Q4 2023. Net income was $2.3B. " * 50
@@ -78,6 +508,207 @@ class TestFinanceRAGPipeline:
         assert chunks > 0
         assert pipeline.document_count == chunks
 
+    @patch("rag_pipeline.OpenAIEmbeddings")
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_ingest_files_adds_documents_once(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        pipeline.vector_manager.stores = {"existing": MagicMock()}
+        pipeline.vector_manager.add_documents = MagicMock(side_effect=len)
+
+        paths = []
+        for name in ["msft", "aapl"]:
+            with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False) as f:
+                f.write(f"{name} revenue grew 10% year over year.\n" * 30)
+                paths.append(f.name)
+        try:
+            chunks = pipeline.ingest_files(paths)
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+        assert chunks > 0
+        assert pipeline.document_count == chunks
+        pipeline.vector_manager.add_documents.assert_called_once()
+        assert len(pipeline.vector_manager.add_documents.call_args[0][0]) == chunks
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_ingest_bytes_mixed_uploads(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        uploads = [
+            ("msft_10k.pdf", make_pdf(["Microsoft revenue was $211.9 billion."])),
+            ("tsla_10k.pdf", make_pdf(["Tesla automotive revenue was $82.4 billion."])),
+            ("notes.txt", b"Analyst target price raised to $250."),
+        ]
+        chunks = pipeline.ingest_bytes(uploads)
+        assert chunks == 3
+        sources = {
+            doc.metadata["source"]
+            for store in pipeline.vector_manager.stores.values()
+            for doc in store.docstore._dict.values()
+        }
+        assert sources == {"msft_10k.pdf", "tsla_10k.pdf", "notes.txt"}
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    @patch("rag_pipeline.load_qa_chain")
+    def test_chain_built_once_across_queries(self, mock_chain, mock_llm, mock_emb):
+        mock_chain.return_value.invoke.return_value = {"output_text": "Revenue was $12B."}
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        pipeline.ingest_text("Q1 revenue was $10B. " * 50, "q1_report")
+
+        pipeline.query("What was Q1 revenue?")
+        pipeline.ingest_text("Q2 revenue was $12B. " * 50, "q2_report")
+        result = pipeline.query("What was Q2 revenue?")
+        assert result["answer"] == "Revenue was $12B."
+        mock_chain.assert_called_once_with(pipeline.llm, chain_type="stuff", prompt=rag_pipeline.FINANCE_PROMPT)
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_concurrent_ingests_from_sessions(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        texts = [(f"Segment {i} revenue grew {i}% on pricing. " * 60, f"report_{i}") for i in range(8)]
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            added = sum(ex.map(lambda args: pipeline.ingest_text(*args), texts))
+        assert pipeline.document_count == added == pipeline.vector_manager.chunk_count
+        assert len(pipeline.vector_manager.stores) == len(texts)
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_load_index_restores_count(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        chunks = pipeline.ingest_text("Free cash flow was $9.4B. " * 80, "cash_flow")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pipeline.save_index(tmp_dir)
+            restored = FinanceRAGPipeline(api_key="sk-test-key")
+            restored.load_index(tmp_dir)
+        assert restored.document_count == chunks
+        assert set(restored.vector_manager.stores) == {"cash_flow"}
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_repeat_query_served_from_cache(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        source_doc = Document(page_content="Revenue: $81.8B", metadata={"source": "aapl"})
+        pipeline.vector_manager.stores = {"aapl": MagicMock()}
+        pipeline.qa_chain = MagicMock()
+        combine = pipeline.qa_chain
+        combine.invoke.return_value = {"output_text": "Revenue was $81.8B."}
+        pipeline.vector_manager.search_by_vector = MagicMock(return_value=[source_doc])
+
+        first = pipeline.query("What was revenue?")
+        assert first["chunks"][0] is source_doc
+        assert first["answer"] == "Revenue was $81.8B."
+        second = pipeline.query("What was revenue?")
+        assert second == first
+        assert combine.invoke.call_count == 1
+
+        pipeline.query("What are the risk factors?")
+        assert combine.invoke.call_count == 2
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_concurrent_queries_keep_cache_aligned(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        pipeline.vector_manager.stores = {"aapl": MagicMock()}
+        pipeline.vector_manager.search_by_vector = MagicMock(return_value=[])
+        pipeline.qa_chain = MagicMock()
+        pipeline.qa_chain.invoke.side_effect = lambda inputs: {"output_text": f"answer to {inputs['question']}"}
+        # The fake embedding seeds numpy's global RNG, so it isn't thread-safe
+        fake, embed_lock = pipeline.vector_manager.embeddings, threading.Lock()
+
+        def embed_query(text):
+            with embed_lock:
+                return fake.embed_query(text)
+
+        pipeline.vector_manager.embeddings = MagicMock(embed_query=MagicMock(side_effect=embed_query))
+
+        questions = [f"Question number {i}?" for i in range(6)]
+        for _ in range(2):  # first pass fills the cache, second reads it
+            with ThreadPoolExecutor(max_workers=6) as ex:
+                results = list(ex.map(pipeline.query, questions))
+            assert [r["answer"] for r in results] == [f"answer to {q}" for q in questions]
+        assert pipeline.qa_chain.invoke.call_count == len(questions)
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_answer_from_before_ingest_not_cached(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        q_emb = pipeline._question_vector(pipeline.vector_manager.embeddings.embed_query("What was EPS?"))
+        _, generation = pipeline._cached_answer(q_emb)
+        pipeline._clear_query_cache()  # a concurrent ingest lands mid-query
+        pipeline._cache_answer(q_emb, {"answer": "stale"}, generation)
+        assert pipeline._cached_answer(q_emb)[0] is None
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_stream_query_yields_tokens_then_caches(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        source_doc = Document(page_content="EPS was $1.26.", metadata={"source": "aapl"})
+        pipeline.vector_manager.stores = {"aapl": MagicMock()}
+        pipeline.vector_manager.search_by_vector = MagicMock(return_value=[source_doc])
+        pipeline.llm.stream.return_value = [MagicMock(content=c) for c in ["EPS ", "was ", "$1.26."]]
+
+        result, tokens = pipeline.stream_query("What was EPS?")
+        assert result["sources"] == ["aapl"]
+        assert list(tokens) == ["EPS ", "was ", "$1.26."]
+        assert result["answer"] == "EPS was $1.26."
+        assert "EPS was $1.26." in pipeline.llm.stream.call_args[0][0]
+
+        cached, cached_tokens = pipeline.stream_query("What was EPS?")
+        assert list(cached_tokens) == ["EPS was $1.26."]
+        assert pipeline.llm.stream.call_count == 1
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_query_many_runs_concurrently_in_order(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        pipeline.vector_manager.stores = {"aapl": MagicMock()}
+        pipeline.vector_manager.search_by_vector = MagicMock(return_value=[])
+        pipeline.qa_chain = MagicMock()
+
+        async def fake_ainvoke(inputs):
+            return {"output_text": f"answer to {inputs['question']}"}
+
+        pipeline.qa_chain.ainvoke.side_effect = fake_ainvoke
+        questions = ["What was revenue?", "What was EPS?", "What is guidance?"]
+        results = pipeline.query_many(questions)
+        assert [r["answer"] for r in results] == [f"answer to {q}" for q in questions]
+        assert pipeline.qa_chain.ainvoke.call_count == 3
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_cache_miss_embeds_question_once(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        pipeline.ingest_text("Operating cash flow was $110B. " * 60, "cash_flow")
+        pipeline.llm.stream.return_value = [MagicMock(content="$110B.")]
+
+        with patch.object(
+            DeterministicFakeEmbedding, "embed_query", autospec=True,
+            side_effect=DeterministicFakeEmbedding.embed_query,
+        ) as spy:
+            result, tokens = pipeline.stream_query("What was operating cash flow?")
+            list(tokens)
+        assert spy.call_count == 1
+        assert result["sources"] == ["cash_flow"]
+
+    @patch("rag_pipeline._get_cross_encoder", return_value=FakeCrossEncoder())
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_rerank_widens_candidate_pool(self, mock_llm, mock_emb, mock_ce):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key", rerank=True)
+        for i in range(30):
+            pipeline.ingest_text(f"Segment {i} gross margin was {i}%. " * 20, f"segment_{i}")
+
+        q_emb = pipeline._question_vector(pipeline.vector_manager.embeddings.embed_query("Gross margin?"))
+        with patch.object(
+            pipeline.vector_manager, "search_by_vector", wraps=pipeline.vector_manager.search_by_vector
+        ) as search:
+            docs = pipeline._retrieve("Gross margin?", q_emb)
+        assert search.call_args[0][1] == 25
+        assert len(docs) == 5
+
     @patch("rag_pipeline.OpenAIEmbeddings")
     @patch("rag_pipeline.ChatOpenAI")
     def test_query_without_documents_raises(self, mock_llm, mock_emb):
@@ -85,6 +716,11 @@ class TestFinanceRAGPipeline:
         with pytest.raises(ValueError, match="No documents ingested"):
             pipeline.query("What is the revenue?")
 
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_unsupported_embedding_backend_raises(self, mock_llm):
+        with pytest.raises(ValueError, match="Unsupported embedding backend"):
+            FinanceRAGPipeline(api_key="sk-test-key", embedding_backend="cohere")
+
     @patch("rag_pipeline.OpenAIEmbeddings")
     @patch("rag_pipeline.ChatOpenAI")
     def test_reset_clears_state(self, mock_llm, mock_emb):
@@ -92,7 +728,24 @@ class TestFinanceRAGPipeline:
         pipeline.document_count = 100
         pipeline.reset()
         assert pipeline.document_count == 0
-        assert pipeline.qa_chain is None
+        assert pipeline.vector_manager.stores == {}
+        assert pipeline.reset_count == 1
+
+    @patch("rag_pipeline.OpenAIEmbeddings", return_value=DeterministicFakeEmbedding(size=32))
+    @patch("rag_pipeline.ChatOpenAI")
+    def test_reset_releases_index(self, mock_llm, mock_emb):
+        pipeline = FinanceRAGPipeline(api_key="sk-test-key")
+        pipeline.ingest_text("Dividend raised to $0.25 per share. " * 60, "dividends")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_dir = os.path.join(tmp_dir, "key", "openai")
+            pipeline.save_index(index_dir)
+            with patch("rag_pipeline.gc.collect") as mock_collect:
+                pipeline.reset(index_dir)
+            assert not os.path.exists(index_dir)
+        mock_collect.assert_called_once()
+        assert pipeline.vector_manager.stores == {}
+        # Re-ingesting the same text works — the dedup hashes were cleared too
+        assert pipeline.ingest_text("Dividend raised to $0.25 per share. " * 60, "dividends") > 0
 
 
 # ──────────────────────────────────────────────